@@ -24,16 +24,28 @@ SOFTWARE.
 """
 import sys
 import logging
+import threading
 
 
 class ErrorHandler:
     def __init__(self, exit_or_log, **logging_config):
         self.exit_or_log = exit_or_log
         self.database = {}
+        # Errors may be reported by several threads judging tests concurrently
+        self._lock = threading.Lock()
         if logging_config == {}:
             logging_config["format"] = "%(asctime)-15s [%(levelname)s] %(message)s"
         logging.basicConfig(**logging_config)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
     def init_student(self, student_id: str):
         self.database[student_id] = ""
 
@@ -49,15 +61,15 @@ class ErrorHandler:
             print(student_id + " " + msg)
             sys.exit(1)
         elif action == "log":
-            if not student_id in self.database.keys():
-                self.init_student(student_id)
-            self.database[student_id] += str(msg) + str("\n")
+            with self._lock:
+                if not student_id in self.database.keys():
+                    self.init_student(student_id)
+                self.database[student_id] += str(msg) + str("\n")
+                if len(self.database[student_id]) > max_len:
+                    self.database[student_id] = self.database[student_id][:max_len]
             logging.error(
                 student_id + " " + msg[:max_len] if len(msg) > max_len else msg
             )
         else:
             print("Cannot handle `" + action + "`. Check ErrorHandler setting.")
             sys.exit(1)
-
-        if len(self.database[student_id]) > max_len:
-            self.database[student_id] = self.database[student_id][:max_len]
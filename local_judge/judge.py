@@ -34,43 +34,114 @@ if sys.version_info < (3,):
         + "Please use Python 3"
     )
 
-import re
-import time
-from subprocess import PIPE, Popen, TimeoutExpired
+import shlex
+import itertools
+import errno
+from subprocess import DEVNULL, PIPE, Popen, TimeoutExpired
+import tempfile
 import os
 from glob import glob as globbing
 from collections import namedtuple
 import configparser
 import argparse
-import errno
-from shutil import copyfile, copymode
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copyfile, copymode, which
 import signal
 import json
+import threading
+import weakref
 
 from . import utils
 from .error_handler import ErrorHandler
 from .report import Report
 
 
-Test = namedtuple("Test", ("test_name", "input_filepath", "answer_filepath"))
+# The diff result beyond this size is not kept for the report
+MAX_DIFF_BYTES = 64 * 1024
+
+Test = namedtuple(
+    "Test", ("test_name", "input_filepath", "answer_filepath", "answer_exists")
+)
 
 
 class LocalJudge:
-    def __init__(self, config, error_handler: ErrorHandler):
-        """Set the member from the config file."""
+    def __init__(
+        self,
+        config,
+        error_handler: ErrorHandler,
+        verbose=0,
+        score_dict=None,
+        total_score=None,
+    ):
+        """Set the member from the config file.
+
+        The diff result is only kept when `verbose` is greater than 0.
+        Already parsed `score_dict` and `total_score` can be given to skip
+        parsing `ScoreDict` and `TotalScore` of the config.
+        """
         self.error_handler = error_handler
+        self.verbose = verbose
         self._config = config
         try:
             self.build_command = self._config["BuildCommand"]
             self.executable = self._config["Executable"]
             self.run_command = self._config["RunCommand"]
-            self.temp_output_dir = self._config["TempOutputDir"]
+            # Absolute so that outputs are found regardless of the cwd of a command
+            self.temp_output_dir = os.path.abspath(self._config["TempOutputDir"])
             self.diff_command = self._config["DiffCommand"]
-            self.delete_temp_output = self._config["DeleteTempOutput"]
+            self.delete_temp_output = self._config["DeleteTempOutput"].lower() == "true"
             self._ans_dir = self._config["AnswerDir"]
             self._ans_ext = self._config["AnswerExtension"]
-            self.score_dict = self._config["ScoreDict"]
-            self.timeout = self._config["Timeout"]
+            if score_dict is None:
+                score_dict = json.loads(self._config["ScoreDict"])
+            self.score_dict = score_dict
+            # total_score will be used when the number of tests out of score_dict
+            if total_score is None:
+                total_score = json.loads(self._config["TotalScore"])
+            self.total_score = total_score
+            self.timeout = float(self._config["Timeout"])
+            # A process group is only needed to kill the whole command on TLE,
+            # so skip creating it when there is no time limit (Timeout <= 0)
+            self._use_pgroup = self.timeout > 0
+            # Build commands are usually chained, e.g., `make clean && make`
+            self.build_uses_shell = self._config.getboolean(
+                "BuildUsesShell", fallback=True
+            )
+            self.sync_file_mode = self._config.getboolean("SyncFileMode", fallback=True)
+            # Commands are split once and run directly unless they need bash
+            self._build_argv = None
+            if not self.build_uses_shell:
+                try:
+                    self._build_argv = shlex.split(self.build_command)
+                except ValueError:
+                    # e.g., an unbalanced quote, which is left for bash to report
+                    pass
+            self._run_argv = None
+            if not utils.needs_shell(self.run_command):
+                self._run_argv, self._run_slots = utils.split_command(self.run_command)
+            self._diff_argv = None
+            self._diff_program_resolved = False
+            if not utils.needs_shell(self.diff_command):
+                self._diff_argv, self._diff_slots = utils.split_command(
+                    self.diff_command
+                )
+                # Resolve a bare diff program (e.g., `git`) once, see _diff()
+                if os.sep not in self._diff_argv[0]:
+                    program = which(self._diff_argv[0])
+                    if program is not None:
+                        self._diff_argv[0] = program
+                        self._diff_program_resolved = True
+            # Used to give each output a unique filename, even across threads
+            self._output_counter = itertools.count()
+            # Started commands and whether they have their own process group,
+            # so that stop() can kill the running ones
+            self._processes = weakref.WeakKeyDictionary()
+            self._processes_lock = threading.Lock()
+            self._stopped = False
+            # Set by build() so run() does not need to stat the executable
+            self._executable_ok = False
+            # (size, digest) of each answer, filled on its first comparison
+            self._answer_digests = {}
             # tests contains corresponding input and answer path
             self.tests = self.inputs_to_tests(self._config["Inputs"])
         except KeyError as e:
@@ -82,51 +153,178 @@ class LocalJudge:
             )
         try:
             # Create the temporary directory for output
-            # Suppress the error when the directory already exists
-            os.makedirs(self.temp_output_dir)
+            os.makedirs(self.temp_output_dir, exist_ok=True)
         except OSError as e:
-            if e.errno != errno.EEXIST:
-                self.error_handler.handle(str(e))
+            self.error_handler.handle(str(e))
+
+    def __getstate__(self):
+        """Drop the output counter and the started commands, which cannot be
+        pickled.
+
+        ta_judge sends the judge to its worker processes by pickling.
+        """
+        state = self.__dict__.copy()
+        del state["_output_counter"]
+        del state["_processes"]
+        del state["_processes_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Restarting is safe since run() removes any output left at its path
+        self._output_counter = itertools.count()
+        self._processes = weakref.WeakKeyDictionary()
+        self._processes_lock = threading.Lock()
 
     def inputs_to_tests(self, inputs):
-        inputs_path = [os.path.abspath(path) for path in globbing(inputs)]
-
-        ret = [
-            Test(
-                utils.get_filename(path),
-                path,
-                utils.expand_path(
-                    self._ans_dir, utils.get_filename(path), self._ans_ext
-                ),
-            )
-            for path in inputs_path
-        ]
+        ret = []
+        for path in globbing(inputs):
+            path = os.path.abspath(path)
+            name = utils.get_filename(path)
+            answer = utils.expand_path(self._ans_dir, name, self._ans_ext)
+            # Answers do not change during a judgement, so check them only once
+            answer_exists = os.path.isfile(answer)
+            ret.append(Test(name, path, answer, answer_exists))
         ret.sort(key=lambda t: t.test_name)
         return ret
 
+    def refresh_answers(self):
+        """Check the answers again, e.g., after they are created or rewritten."""
+        self._answer_digests.clear()
+        self.tests = [
+            test._replace(answer_exists=os.path.isfile(test.answer_filepath))
+            for test in self.tests
+        ]
+
+    @staticmethod
+    def _spawn(cmd, cwd, stdout=DEVNULL, start_new_session=False, close_fds=True):
+        """Start an argv list directly, or a command string through bash.
+
+        The stdout is discarded by default; only the stderr is captured.
+        """
+        if isinstance(cmd, str):
+            return Popen(
+                cmd,
+                stdout=stdout,
+                stderr=PIPE,
+                shell=True,
+                executable="bash",
+                cwd=cwd,
+                start_new_session=start_new_session,
+            )
+        try:
+            return Popen(
+                cmd,
+                stdout=stdout,
+                stderr=PIPE,
+                cwd=cwd,
+                start_new_session=start_new_session,
+                close_fds=close_fds,
+            )
+        except OSError as e:
+            if e.errno != errno.ENOEXEC:
+                raise
+            # Like bash, run a script without shebang as a bash script
+            return LocalJudge._spawn(
+                " ".join(shlex.quote(arg) for arg in cmd),
+                cwd,
+                stdout=stdout,
+                start_new_session=start_new_session,
+            )
+
+    def _start(self, cmd, cwd, start_new_session=False, **kwargs):
+        """Spawn the command and keep it so that stop() can kill it."""
+        process = self._spawn(cmd, cwd, start_new_session=start_new_session, **kwargs)
+        with self._processes_lock:
+            self._processes[process] = start_new_session
+            stopped = self._stopped
+        if stopped:
+            # stop() was called while spawning, so it missed this command
+            self._stop_process(process, start_new_session)
+            raise KeyboardInterrupt
+        return process
+
+    @staticmethod
+    def _stop_process(process, own_group):
+        """Kill the command, including its process group if it has its own."""
+        try:
+            if own_group:
+                os.killpg(process.pid, signal.SIGTERM)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+
+    def stop(self):
+        """Kill the running commands and refuse to start new ones.
+
+        Only the main thread receives Ctrl-C, so the commands started by
+        other threads are killed here instead.
+        """
+        with self._processes_lock:
+            self._stopped = True
+            processes = list(self._processes.items())
+        for process, own_group in processes:
+            if process.poll() is None:
+                self._stop_process(process, own_group)
+
+    def map_tests(self, fn, executor=None):
+        """Map `fn` over the tests, concurrently if `executor` is given.
+
+        Tests are run one by one when errors exit, so that the judgement
+        stops at the first error. If the waiting is interrupted, e.g., by
+        Ctrl-C or an exit, the pending tests are cancelled and the running
+        commands are killed.
+        """
+        if executor is None or self.error_handler.exit_or_log == "exit":
+            return list(map(fn, self.tests))
+        futures = [executor.submit(fn, test) for test in self.tests]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            self.stop()
+            raise
+
+    def _time_limit(self):
+        """Get the timeout for each command, which is None without a limit."""
+        return self.timeout if self._use_pgroup else None
+
+    def _kill(self, process):
+        """Kill the command, including its children if it has a process group."""
+        if self._use_pgroup:
+            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+        else:
+            process.kill()
+
     def build(self, student_id="local", cwd="./"):
         """Build the executable which needs to be judged."""
+        self._executable_ok = False
         err = ""
-        process = Popen(
-            self.build_command,
-            stdout=PIPE,
-            stderr=PIPE,
-            shell=True,
-            executable="bash",
-            cwd=cwd,
-            start_new_session=True,
-        )
         try:
-            _, err = process.communicate(timeout=float(self.timeout))
+            process = self._start(
+                self.build_command if self._build_argv is None else self._build_argv,
+                cwd=cwd,
+                start_new_session=self._use_pgroup,
+            )
+        except OSError as e:
+            self.error_handler.handle(
+                "Failed in build stage. Error message:\n\n" + str(e) + "\n",
+                student_id=student_id,
+            )
+            return
+        try:
+            _, err = process.communicate(timeout=self._time_limit())
         except TimeoutExpired:
-            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+            self._kill(process)
             # Ref: https://stackoverflow.com/a/44705997
             self.error_handler.handle(
                 f"TLE at build stage; kill `{self.build_command}`",
                 student_id=student_id,
             )
         except KeyboardInterrupt:
-            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+            self._kill(process)
             raise KeyboardInterrupt from None
         if process.returncode != 0:
             self.error_handler.handle(
@@ -136,7 +334,8 @@ class LocalJudge:
                 + "Please check `Makefile`, your file architecture, or your program.",
                 student_id=student_id,
             )
-        if not os.path.isfile(cwd + self.executable):
+        self._executable_ok = os.path.isfile(cwd + self.executable)
+        if not self._executable_ok:
             self.error_handler.handle(
                 "Failed in build stage. "
                 + "executable `"
@@ -152,40 +351,56 @@ class LocalJudge:
 
         The output will be temporarily placed in specific location,
         and the path will be returned for the validation.
+        With `with_timestamp`, a unique counter (no longer the time) is
+        appended to the output filename.
         """
-        if not os.path.isfile(cwd + self.executable):
+        if not self._executable_ok:
             return 1, "no_executable_to_run"
-        output_filepath = os.path.join(
-            self.temp_output_dir, utils.get_filename(input_filepath)
-        )
+        input_name = utils.get_filename(input_filepath)
+        output_filepath = os.path.join(self.temp_output_dir, input_name)
         if with_timestamp:
-            output_filepath += student_id + "_" + str(int(time.time()))
+            output_filepath += student_id + "_" + str(next(self._output_counter))
         output_filepath += self._ans_ext
-        cmd = self.run_command
-        cmd = re.sub(r"{input}", input_filepath, cmd)
-        cmd = re.sub(r"{output}", output_filepath, cmd)
-        process = Popen(
-            cmd,
-            stdout=PIPE,
-            stderr=PIPE,
-            shell=True,
-            executable="bash",
-            cwd=cwd,
-            start_new_session=True,
-        )
+        # The counter restarts in every process, so an output of an earlier
+        # run may be at the same path and must not be judged instead
+        try:
+            os.remove(output_filepath)
+        except FileNotFoundError:
+            pass
+        if self._run_argv is None:
+            cmd = self.run_command.replace("{input}", input_filepath).replace(
+                "{output}", output_filepath
+            )
+        else:
+            cmd = utils.fill_argv(
+                self._run_argv,
+                self._run_slots,
+                input=input_filepath,
+                output=output_filepath,
+            )
         try:
-            _, err = process.communicate(timeout=float(self.timeout))
+            process = self._start(cmd, cwd=cwd, start_new_session=self._use_pgroup)
+        except OSError as e:
+            self.error_handler.handle(
+                "Failed in run stage. Error message:\n\n" + str(e) + "\n",
+                student_id=student_id,
+            )
+            return 127, output_filepath
+        try:
+            _, err = process.communicate(timeout=self._time_limit())
         except TimeoutExpired:
-            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+            self._kill(process)
             # Ref: https://stackoverflow.com/a/44705997
+            if not isinstance(cmd, str):
+                cmd = " ".join(cmd)
             self.error_handler.handle(
-                f"TLE at {utils.get_filename(input_filepath)}; kill `{cmd}`",
+                f"TLE at {input_name}; kill `{cmd}`",
                 student_id=student_id,
             )
             process.returncode = 124
             return process.returncode, output_filepath
         except KeyboardInterrupt:
-            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+            self._kill(process)
             raise KeyboardInterrupt from None
         if process.returncode != 0:
             self.error_handler.handle(
@@ -204,11 +419,13 @@ class LocalJudge:
         run_returncode,
         student_id="local",
         cwd="./",
+        answer_exists=None,
     ):
         """Verify the differences between output and answer.
 
         If the files are identical, the accept will be set to True.
         Another return value is the diff result.
+        `answer_exists` can be given to skip checking the answer file again.
         """
         if run_returncode != 0:
             return False, ""
@@ -222,7 +439,9 @@ class LocalJudge:
                 student_id=student_id,
             )
             return False, "no_output_file"
-        if not os.path.isfile(answer_filepath):
+        if answer_exists is None:
+            answer_exists = os.path.isfile(answer_filepath)
+        if not answer_exists:
             self.error_handler.handle(
                 "There was no any corresponding answer `"
                 + answer_filepath
@@ -231,23 +450,86 @@ class LocalJudge:
                 student_id=student_id,
             )
             return False, "no_answer_file"
-        # Sync the file mode
-        copymode(answer_filepath, output_filepath)
-        cmd = re.sub(r"{output}", output_filepath, self.diff_command)
-        cmd = re.sub(r"{answer}", answer_filepath, cmd)
-        process = Popen(
-            cmd,
-            stdout=PIPE,
-            stderr=PIPE,
-            shell=True,
-            executable="bash",
-            cwd=cwd,
-        )
-        try:
-            out, err = process.communicate()
-        except KeyboardInterrupt:
-            process.kill()
-            raise KeyboardInterrupt from None
+        if self._same_as_answer(output_filepath, answer_filepath):
+            # Identical files pass any diff command, so there is no need to run it
+            accept, diff = True, ""
+        else:
+            if self.sync_file_mode:
+                # `git diff --no-index` also reports the difference of file modes
+                copymode(answer_filepath, output_filepath)
+            accept, diff = self._diff(
+                output_filepath, answer_filepath, student_id=student_id, cwd=cwd
+            )
+        if self.delete_temp_output:
+            os.remove(output_filepath)
+        return accept, diff
+
+    def _answer_digest(self, answer_filepath):
+        """Get the (size, digest) of the answer, which is only read once."""
+        if answer_filepath not in self._answer_digests:
+            self._answer_digests[answer_filepath] = (
+                os.path.getsize(answer_filepath),
+                utils.file_digest(answer_filepath),
+            )
+        return self._answer_digests[answer_filepath]
+
+    def _same_as_answer(self, output_filepath, answer_filepath):
+        """Check whether the output is byte-identical to the answer."""
+        size, digest = self._answer_digest(answer_filepath)
+        if os.path.getsize(output_filepath) != size:
+            return False
+        return utils.file_digest(output_filepath) == digest
+
+    def _diff(self, output_filepath, answer_filepath, student_id="local", cwd="./"):
+        """Run the diff command, which decides whether the output is accepted.
+
+        The diff result is streamed to a temporary file and at most
+        `MAX_DIFF_BYTES` of it is returned. Without verbose, it is discarded.
+        """
+        if self._diff_argv is None:
+            cmd = self.diff_command.replace("{output}", output_filepath).replace(
+                "{answer}", answer_filepath
+            )
+        else:
+            cmd = utils.fill_argv(
+                self._diff_argv,
+                self._diff_slots,
+                output=output_filepath,
+                answer=answer_filepath,
+            )
+        if self.verbose > 0:
+            out_file = tempfile.TemporaryFile()
+        else:
+            out_file = open(os.devnull, "wb")
+        with out_file:
+            try:
+                if self._diff_program_resolved and os.path.abspath(cwd) == os.getcwd():
+                    # With an absolute program, no cwd, and no close_fds,
+                    # subprocess can use posix_spawn() instead of fork().
+                    # Only when cwd is already the current directory, since
+                    # arguments may be relative to it
+                    process = self._start(
+                        cmd, cwd=None, stdout=out_file, close_fds=False
+                    )
+                else:
+                    process = self._start(cmd, cwd=cwd, stdout=out_file)
+            except OSError as e:
+                self.error_handler.handle(
+                    "Failed in compare stage. Error message:\n\n" + str(e),
+                    student_id=student_id,
+                )
+                return False, ""
+            try:
+                _, err = process.communicate()
+            except KeyboardInterrupt:
+                process.kill()
+                raise KeyboardInterrupt from None
+            out = b""
+            if self.verbose > 0:
+                out_file.seek(0)
+                out = out_file.read(MAX_DIFF_BYTES + 1)
+                if len(out) > MAX_DIFF_BYTES:
+                    out = out[:MAX_DIFF_BYTES] + b"\n[diff result truncated]"
         # If there is difference between two files, the return code is not 0
         if str(err, encoding="utf8").strip() != "":
             self.error_handler.handle(
@@ -255,11 +537,26 @@ class LocalJudge:
                 + str(err, encoding="utf8"),
                 student_id=student_id,
             )
-        if self.delete_temp_output == "true":
-            os.remove(output_filepath)
         accept = process.returncode == 0
         return accept, str(out, encoding="utf8", errors="ignore")
 
+    def judge_test(self, test, student_id="local", cwd="./"):
+        """Run the executable with the input of test and compare with its answer.
+
+        Tests are independent, so this can be mapped over a pool of workers.
+        """
+        returncode, output_filepath = self.run(
+            test.input_filepath, student_id=student_id, cwd=cwd
+        )
+        return self.compare(
+            output_filepath,
+            test.answer_filepath,
+            returncode,
+            student_id=student_id,
+            cwd=cwd,
+            answer_exists=test.answer_exists,
+        )
+
 
 def get_args():
     """Init argparser and return the args from cli."""
@@ -288,52 +585,68 @@ def get_args():
         type=str,
         default=None,
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of tests to judge concurrently",
+        type=int,
+        default=1,
+    )
     return parser.parse_args()
 
 
-def judge_all_tests(judge: LocalJudge, verbose_level, score_dict, total_score):
+def judge_all_tests(
+    judge: LocalJudge, verbose_level, score_dict, total_score, executor=None
+):
     """Judge all tests for given program.
 
     If `--input` is set, there is only one input in this judgement.
+    If `executor` is given, the tests are run concurrently by its workers.
     """
 
+    # The judge only keeps the diff results when the report shows them
+    judge.verbose = verbose_level
     judge.build()
 
     report = Report(
         report_verbose=verbose_level, score_dict=score_dict, total_score=total_score
     )
-    for test in judge.tests:
-        returncode, output_filepath = judge.run(test.input_filepath)
-        accept, diff = judge.compare(output_filepath, test.answer_filepath, returncode)
+    results = judge.map_tests(judge.judge_test, executor)
+    for test, (accept, diff) in zip(judge.tests, results):
         report.table.append({"test": test.test_name, "accept": accept, "diff": diff})
     return report.print_report()
 
 
-def copy_output_to_dir(judge: LocalJudge, output_dir, delete_temp_output, ans_ext):
+def copy_output_to_dir(
+    judge: LocalJudge, output_dir, delete_temp_output, ans_ext, executor=None
+):
     """Copy output files into given directory without judgement.
 
     Usually used to create answer files or save the outputs for debugging.
+    If `executor` is given, the tests are run concurrently by its workers.
     """
     try:
-        # Create the temporary directory for output
-        # Suppress the error when the directory already exists
-        os.makedirs(output_dir)
+        # Create the directory for output
+        os.makedirs(output_dir, exist_ok=True)
     except OSError as e:
-        if e.errno != errno.EEXIST:
-            judge.error_handler.handle(
-                str(e),
-                exit_or_log="exit",
-            )
+        judge.error_handler.handle(
+            str(e),
+            exit_or_log="exit",
+        )
     judge.build()
 
-    for test in judge.tests:
-        _, output_filepath = judge.run(test.input_filepath, with_timestamp=False)
+    def run_test(test):
+        return judge.run(test.input_filepath, with_timestamp=False)[1]
+
+    for output_filepath in judge.map_tests(run_test, executor):
         copyfile(
             output_filepath,
             utils.expand_path(output_dir, utils.get_filename(output_filepath), ans_ext),
         )
-        if delete_temp_output == "true":
+        if delete_temp_output:
             os.remove(output_filepath)
+    # The outputs may have replaced the answers
+    judge.refresh_answers()
 
 
 def main() -> int:
@@ -346,7 +659,15 @@ def main() -> int:
     config = configparser.RawConfigParser()
     config.read(args.config)
 
-    judge = LocalJudge(config["Config"], ErrorHandler(config["Config"]["ExitOrLog"]))
+    # Show the diff result when judging only one input
+    if not args.input is None:
+        args.verbose = True
+
+    judge = LocalJudge(
+        config["Config"],
+        ErrorHandler(config["Config"]["ExitOrLog"]),
+        verbose=args.verbose,
+    )
     returncode = 0
 
     # Check if the config file is empty or not exist.
@@ -358,24 +679,32 @@ def main() -> int:
 
     # Assign specific input for this judgement
     if not args.input is None:
-        args.verbose = True
         judge.tests = judge.inputs_to_tests(
             utils.create_specific_input(args.input, config)
         )
 
-    # Copy output files into given directory without judgement
-    if not args.output is None:
-        copy_output_to_dir(
-            judge,
-            args.output,
-            config["Config"]["DeleteTempOutput"],
-            config["Config"]["AnswerExtension"],
-        )
+    # Tests are judged one by one unless more jobs are given. The pool is
+    # shared by copying outputs and judging
+    executor = None
+    if args.jobs > 1:
+        executor = ThreadPoolExecutor(max_workers=args.jobs)
+    try:
+        # Copy output files into given directory without judgement
+        if not args.output is None:
+            copy_output_to_dir(
+                judge,
+                args.output,
+                judge.delete_temp_output,
+                config["Config"]["AnswerExtension"],
+                executor,
+            )
 
-    score_dict = json.loads(config["Config"]["ScoreDict"])
-    # total_score will be used when the number of tests out of score_dict
-    total_score = json.loads(config["Config"]["TotalScore"])
-    returncode = judge_all_tests(judge, args.verbose, score_dict, total_score)
+        returncode = judge_all_tests(
+            judge, args.verbose, judge.score_dict, judge.total_score, executor
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
     return returncode
 
 
@@ -23,8 +23,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import sys
-from itertools import repeat
-from subprocess import check_output, CalledProcessError
+import shutil
 
 GREEN = "\033[32m"
 RED = "\033[31m"
@@ -34,12 +33,16 @@ NC = "\033[0m"
 class Report:
     def __init__(self, report_verbose=0, score_dict=None, total_score=0):
         self.score_dict = score_dict
+        # Convert the score_dict once, e.g., {"1": "30"} -> {1: 30}
+        self._scores = {}
+        if score_dict is not None:
+            self._scores = {int(k): int(v) for k, v in score_dict.items()}
         self.total_score = total_score
         self.report_verbose = report_verbose
         self.table = []
 
     def get_score_by_correct_cnt(self, correct_cnt: int):
-        return int(self.score_dict[str(correct_cnt)])
+        return self._scores[correct_cnt]
 
     def print_report(self) -> int:
         """Print the report into table view."""
@@ -57,17 +60,12 @@ class Report:
             return 1
 
         # Get the window size of the current terminal.
-        columns = 100
-        try:
-            _, columns = check_output(["stty", "size"]).split()
-        except CalledProcessError as e:
-            pass  # We cannot get the size of stty during testing.
+        # Fall back to 100 columns when stdout is not a terminal (e.g., testing).
+        columns = shutil.get_terminal_size(fallback=(100, 24)).columns
 
         test_len = max(len(max(tests, key=len)), len("Sample"))
-        doubledash = "".join(list(repeat("=", int(columns))))
-        doubledash = doubledash[: test_len + 1] + "+" + doubledash[test_len + 2 :]
-        dash = "".join(list(repeat("-", int(columns))))
-        dash = dash[: test_len + 1] + "+" + dash[test_len + 2 :]
+        doubledash = "=" * (test_len + 1) + "+" + "=" * (columns - test_len - 2)
+        dash = "-" * (test_len + 1) + "+" + "-" * (columns - test_len - 2)
 
         print(doubledash)
         print("{:>{width}} | {}".format("Sample", "Accept", width=test_len))
@@ -81,16 +79,17 @@ class Report:
         print(doubledash)
 
         # The test which ends with "hide" will not be count to calculate the score.
-        correct_cnt = [
-            row["accept"] for row in self.table if not row["test"].endswith("hide")
-        ].count(True)
-        valid_test_number = len(
-            [test for test in tests if not test.endswith("hide")]
-        )  # not to count hide test case
+        correct_cnt = 0
+        valid_test_number = 0  # not to count hide test case
+        for row in self.table:
+            if not row["test"].endswith("hide"):
+                valid_test_number += 1
+                if row["accept"]:
+                    correct_cnt += 1
         total_score = 0
         obtained_score = 0
         try:  # try to use score_dict first
-            total_score = int(self.score_dict[str(valid_test_number)])
+            total_score = self._scores[valid_test_number]
             obtained_score = self.get_score_by_correct_cnt(correct_cnt)
         except KeyError:  # if the number of tests out of range, use total_score
             total_score = self.total_score
@@ -37,7 +37,6 @@ if sys.version_info < (3,):
 import argparse
 import configparser
 import os
-import errno
 from openpyxl import load_workbook
 from zipfile import ZipFile
 import rarfile
@@ -49,6 +48,8 @@ import logging
 import multiprocessing
 import signal
 import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 from .judge import LocalJudge
 from .error_handler import ErrorHandler
@@ -75,15 +76,13 @@ class TaJudge:
                 exit_or_log="exit",
             )
         try:
-            # Create the temporary directory for output
-            # Suppress the error when the directory already exists
-            os.makedirs(self.students_extract_dir)
+            # Create the directory for extracted homeworks
+            os.makedirs(self.students_extract_dir, exist_ok=True)
         except OSError as e:
-            if e.errno != errno.EEXIST:
-                self.error_handler.handle(
-                    str(e),
-                    exit_or_log="exit",
-                )
+            self.error_handler.handle(
+                str(e),
+                exit_or_log="exit",
+            )
         self.students_zips = globbing(self.students_zip_container + os.sep + "*")
         # Parse the students' id and sort them
         self.students = self._parse_students()
@@ -171,9 +170,17 @@ def append_log_msg(ori_result, log_msg, in_log=1):
 
 
 def judge_one_student(
-    student, all_student_results, tj: TaJudge, lj: LocalJudge, skip_report=False
+    student,
+    all_student_results,
+    tj: TaJudge,
+    lj: LocalJudge,
+    skip_report=False,
+    executor=None,
 ):
-    """Judge one student and return the correctness result."""
+    """Judge one student and return the correctness result.
+
+    If `executor` is given, the tests of the student are run concurrently.
+    """
     lj.error_handler.init_student(student.id)
     print(student.id)
     student_path = student.extract_path + os.sep
@@ -188,17 +195,11 @@ def judge_one_student(
         )
     else:
         lj.build(student_id=student.id, cwd=student_path)
-        for i in range(len(lj.tests)):
-            returncode, output = lj.run(
-                lj.tests[i].input_filepath, student_id=student.id, cwd=student_path
-            )
-            accept, diff = lj.compare(
-                output,
-                lj.tests[i].answer_filepath,
-                returncode,
-                student_id=student.id,
-                cwd=student_path,
-            )
+        judge_test = functools.partial(
+            lj.judge_test, student_id=student.id, cwd=student_path
+        )
+        results = lj.map_tests(judge_test, executor)
+        for i, (accept, diff) in enumerate(results):
             if not skip_report:
                 report_table.append(
                     {"test": lj.tests[i].test_name, "accept": accept, "diff": diff}
@@ -319,7 +320,7 @@ def main():
 
     eh = ErrorHandler(ta_config["Config"]["ExitOrLog"], **logging_config)
     tj = TaJudge(ta_config["TaConfig"], eh)
-    lj = LocalJudge(ta_config["Config"], eh)
+    lj = LocalJudge(ta_config["Config"], eh, verbose=args.verbose)
 
     if not args.student is None:
         # Assign specific student for this judgement and report to screen
@@ -334,9 +335,14 @@ def main():
             "none",
             os.path.abspath(tj.students_extract_dir + os.sep + extract_path),
         )
-        res_dict = judge_one_student(student, None, tj, lj, False)
+        with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+            res_dict = judge_one_student(student, None, tj, lj, False, executor)
 
-        report = Report(report_verbose=args.verbose, score_dict=lj.score_dict)
+        report = Report(
+            report_verbose=args.verbose,
+            score_dict=lj.score_dict,
+            total_score=lj.total_score,
+        )
         report.table = res_dict["report_table"]
         report.print_report()
 
@@ -353,7 +359,8 @@ def main():
             "none",
             os.path.abspath(tj.students_extract_dir + os.sep + extract_path),
         )
-        res_dict = judge_one_student(student, None, tj, lj, False)
+        with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+            res_dict = judge_one_student(student, None, tj, lj, False, executor)
         result = res_dict["result"]
         # Load existing table
         book = load_workbook(ta_config["TaConfig"]["ScoreOutput"])
@@ -391,7 +398,7 @@ def main():
             for async_result_i in async_result_list:
                 try:
                     async_result_i["async_result"].get(
-                        float(lj.timeout) * len(lj.tests) * 10
+                        lj.timeout * len(lj.tests) * 10 if lj.timeout > 0 else None
                     )
                 except multiprocessing.TimeoutError:
                     print(async_result_i["student_id"], "total TLE skip")
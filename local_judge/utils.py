@@ -22,9 +22,27 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-import os, sys
+import os, re, sys
+import functools
+import hashlib
+import shlex
 
+# Redirection, pipes, expansions, globs and leading variable assignments
+# all need a shell to be interpreted.
+_SHELL_SYNTAX = re.compile(r"[|&;<>()$`\\*?\[\]~!#\n]|^\s*\w+=")
+# Keywords and builtins which have no program to execute, e.g., `time ./a`
+_SHELL_WORDS = set(
+    "time exec if for while until case select function coproc [[ { . source "
+    "cd eval export set unset shopt ulimit umask command builtin alias "
+    "declare local let read trap wait".split()
+)
+# Placeholders of commands, e.g., {input}
+_PLACEHOLDER = re.compile(r"{(\w+)}")
+# Placeholders filled by the judge; any other brace may be a brace expansion
+_JUDGE_PLACEHOLDER = re.compile(r"{(?:input|output|answer)}")
 
+
+@functools.lru_cache(maxsize=4096)
 def get_filename(path):
     """Get the filename without extension
 
@@ -42,6 +60,59 @@ def expand_path(dir, filename, extension):
     return os.path.abspath(os.path.join(dir, filename + extension))
 
 
+def file_digest(path, chunk_size=1 << 16):
+    """Get the blake2b digest of the file content"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+def needs_shell(command):
+    """Check whether the command uses any shell syntax
+
+    ./scanner {input} -> False
+    ./scanner < {input} > {output} -> True
+    time ./scanner {input} -> True
+    ./scanner {input} {1..3} -> True
+    """
+    if _SHELL_SYNTAX.search(command) is not None:
+        return True
+    if "{" in _JUDGE_PLACEHOLDER.sub("", command):
+        return True
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        # e.g., an unbalanced quote, which is left for bash to report
+        return True
+    return not words or words[0] in _SHELL_WORDS
+
+
+def split_command(command):
+    """Split the command into argv and find the tokens with placeholders
+
+    ./scanner {input} -> (["./scanner", "{input}"], [1])
+    """
+    argv = shlex.split(command)
+    return argv, [i for i, token in enumerate(argv) if "{" in token]
+
+
+def fill_argv(argv, slots, **fields):
+    """Fill the placeholders of the tokens at the given slots
+
+    ["./scanner", "{input}"], [1], input="a.txt" -> ["./scanner", "a.txt"]
+    """
+    # Substitute in one pass so that a value is never substituted again
+    def field(match):
+        return fields.get(match.group(1), match.group(0))
+
+    argv = list(argv)
+    for i in slots:
+        argv[i] = _PLACEHOLDER.sub(field, argv[i])
+    return argv
+
+
 def create_specific_input(input_name_or_path, config):
     if os.path.isfile(input_name_or_path):
         specific_input = input_name_or_path
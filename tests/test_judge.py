@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2020 Huang Po-Hsuan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import sys
+import time
+import pytest
+
+from local_judge.judge import MAX_DIFF_BYTES, LocalJudge, judge_all_tests, main
+from local_judge.error_handler import ErrorHandler
+
+CONFIG = """[Config]
+BuildCommand = chmod +x prog
+Executable = prog
+RunCommand = {run}
+Inputs = input/*.txt
+AnswerDir = answer
+AnswerExtension = .out
+DiffCommand = {diff}
+TempOutputDir = output
+DeleteTempOutput = true
+ExitOrLog = log
+ScoreDict = {{"0":"0","1":"30","2":"60","3":"100"}}
+TotalScore = 100
+Timeout = {timeout}
+"""
+
+
+@pytest.fixture
+def project(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Create a program which doubles the number in its input"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "input").mkdir()
+    (tmp_path / "answer").mkdir()
+    for i in range(1, 4):
+        (tmp_path / "input" / f"{i}.txt").write_text(f"{i}\n")
+        (tmp_path / "answer" / f"{i}.out").write_text(f"{i * 2}\n")
+    # Without shebang, so the program can only be run by bash
+    (tmp_path / "prog").write_text('read n < "$1"\necho $((n * 2)) > "$2"\n')
+    return tmp_path
+
+
+def make_judge(
+    project: Path,
+    run: str = "./prog {input} {output}",
+    diff: str = "diff {answer} {output}",
+    timeout: str = "10",
+) -> LocalJudge:
+    (project / "judge.conf").write_text(
+        CONFIG.format(run=run, diff=diff, timeout=timeout)
+    )
+    config = configparser.RawConfigParser()
+    config.read(project / "judge.conf")
+    judge = LocalJudge(config["Config"], ErrorHandler("log"))
+    judge.build()
+    return judge
+
+
+@pytest.mark.parametrize(
+    "run",
+    [
+        "./prog {input} {output}",
+        "bash prog {input} {output}",
+        "time ./prog {input} {output}",
+    ],
+)
+def test_run_without_shebang(project: Path, run: str):
+    judge = make_judge(project, run=run)
+    assert [judge.judge_test(test) for test in judge.tests] == [(True, "")] * 3
+
+
+def test_identical_output_skips_diff(project: Path):
+    # The diff command rejects everything, so only identical outputs pass
+    judge = make_judge(project, diff="false {answer} {output}")
+    (project / "answer" / "3.out").write_text("7\n")
+    assert [judge.judge_test(test)[0] for test in judge.tests] == [True, True, False]
+
+
+def test_diff_runs_in_cwd(project: Path):
+    # A checker next to the student's program which accepts everything
+    student = project / "student"
+    student.mkdir()
+    (student / "check.py").write_text("import sys\nsys.exit(0)\n")
+    judge = make_judge(project, diff="python3 check.py {answer} {output}")
+    output = project / "output" / "3.out"
+    output.write_text("7\n")
+    answer = judge.tests[2].answer_filepath
+    assert judge.compare(str(output), answer, 0, cwd=str(student) + "/") == (True, "")
+
+
+def test_create_answers_then_judge(
+    project: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+):
+    make_judge(project)
+    for answer in (project / "answer").iterdir():
+        answer.unlink()
+    monkeypatch.setattr(sys, "argv", ["judge", "-o", "answer"])
+    assert main() == 0
+    assert "100/100" in capsys.readouterr().out
+
+
+def test_stale_output_is_not_judged(project: Path):
+    judge = make_judge(project)
+    judge.delete_temp_output = False
+    assert judge.judge_test(judge.tests[0]) == (True, "")
+    # A new judge reuses the output path, but the program writes nothing now
+    (project / "prog").write_text("exit 0\n")
+    judge = make_judge(project)
+    assert judge.judge_test(judge.tests[0]) == (False, "no_output_file")
+
+
+@pytest.mark.parametrize(
+    "prog, diff",
+    [
+        ("sleep 5\n", "diff {answer} {output}"),
+        # The diff command is not in its own process group
+        (
+            'echo 0 > "$2"\n',
+            "python3 -c 'import time; time.sleep(5)' {answer} {output}",
+        ),
+    ],
+)
+def test_interrupt_kills_running_tests(project: Path, prog: str, diff: str):
+    (project / "prog").write_text(prog)
+    judge = make_judge(project, diff=diff)
+
+    def judge_test(test):
+        # Like Ctrl-C received by the main thread while the others are running
+        if test is judge.tests[0]:
+            time.sleep(0.5)
+            raise KeyboardInterrupt
+        return judge.judge_test(test)
+
+    start = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            judge.map_tests(judge_test, executor)
+    assert time.monotonic() - start < 3
+
+
+def test_unbalanced_quote_is_reported(project: Path):
+    judge = make_judge(project, run="./prog '{input} {output}")
+    assert judge.judge_test(judge.tests[0]) == (False, "")
+    assert "Failed in run stage" in judge.error_handler.get_error("local")
+
+
+def test_long_diff_is_truncated(project: Path):
+    judge = make_judge(project)
+    judge.verbose = 1
+    (project / "answer" / "1.out").write_text("x\n" * MAX_DIFF_BYTES)
+    accept, diff = judge.judge_test(judge.tests[0])
+    assert not accept
+    assert diff.endswith("\n[diff result truncated]")
+    assert len(diff) == MAX_DIFF_BYTES + len("\n[diff result truncated]")
+
+
+def test_diff_is_discarded_without_verbose(project: Path):
+    judge = make_judge(project)
+    (project / "answer" / "1.out").write_text("7\n")
+    assert judge.judge_test(judge.tests[0]) == (False, "")
+
+
+def test_report_verbose_keeps_diff(project: Path, capsys: pytest.CaptureFixture):
+    judge = make_judge(project)
+    (project / "answer" / "1.out").write_text("7\n")
+    judge_all_tests(judge, 1, judge.score_dict, judge.total_score)
+    assert "> 2" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("timeout", ["0", "-1"])
+def test_no_time_limit(project: Path, timeout: str):
+    (project / "prog").write_text('sleep 0.2\nread n < "$1"\necho $((n * 2)) > "$2"\n')
+    judge = make_judge(project, timeout=timeout)
+    assert [judge.judge_test(test) for test in judge.tests] == [(True, "")] * 3
+    assert judge.error_handler.get_error("local") == ""
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+MIT License
+
+Copyright (c) 2020 Huang Po-Hsuan
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import pytest
+
+from local_judge import utils
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        "./scanner {input} {output}",
+        "python3 check.py {answer} {output}",
+        "git diff --no-index --color-words {answer} {output}",
+        'diff "{answer}" {output}',
+        "timeout 1 ./scanner {input}",
+    ],
+)
+def test_needs_shell_false(command: str):
+    assert not utils.needs_shell(command)
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        "./scanner < {input} > {output}",
+        "make clean && make",
+        "./scanner {input} | tee {output}",
+        "diff <(sort {answer}) <(sort {output})",
+        "./scanner $HOME/{input}",
+        "./scanner input/*.txt",
+        "FOO=1 ./scanner {input}",
+        "time ./scanner {input} {output}",
+        "exec ./scanner {input} {output}",
+        "./scanner {input} {1..3}",
+        "./scanner {input} {a,b}.txt",
+        "./scanner '{input}",
+        "",
+    ],
+)
+def test_needs_shell_true(command: str):
+    assert utils.needs_shell(command)
+
+
+def test_split_command():
+    argv, slots = utils.split_command('diff -u "{answer}" --label={output} {output}')
+    assert argv == ["diff", "-u", "{answer}", "--label={output}", "{output}"]
+    assert slots == [2, 3, 4]
+
+
+def test_fill_argv():
+    argv, slots = utils.split_command("./scanner {input} -o {output} --ext={ext}")
+    filled = utils.fill_argv(
+        argv, slots, ext="{input}", input="in/a b.txt", output="/tmp/{x}.out"
+    )
+    assert filled == ["./scanner", "in/a b.txt", "-o", "/tmp/{x}.out", "--ext={input}"]
+    # The template is left untouched for the next test
+    assert argv == ["./scanner", "{input}", "-o", "{output}", "--ext={ext}"]